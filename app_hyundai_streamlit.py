@@ -1,6 +1,8 @@
+import io
 import streamlit as st
 import pandas as pd
 import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -14,69 +16,132 @@ HERE = Path(__file__).resolve().parent
 DB_PATH = (HERE / hy.DB_PATH) if not Path(hy.DB_PATH).is_absolute() else Path(hy.DB_PATH)
 TEMPLATE_XLSX = (HERE / hy.TEMPLATE_XLSX) if not Path(hy.TEMPLATE_XLSX).is_absolute() else Path(hy.TEMPLATE_XLSX)
 
+# Columnas visibles en el listado (en este orden, si existen)
+SHOW_COLS_CANDIDATE = (
+    "id","fecha","hora","equipo","litros_despachados","volumen_despachado","responsable",
+    "contador_inicial_show","contador_final_show","Secuencia_Contador","Delta_Litros","tipo_registro",
+    "horometro_inicial","horometro_final","horas_trabajadas","consumo_por_gl_h","precio_diesel","costo_diesel_usd",
+)
+
 # Asegura esquema al iniciar
 hy.ensure_schema(str(DB_PATH))
 
 # -------- Helpers ----------
-def conn():
-    return sqlite3.connect(str(DB_PATH))
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """Conexión única y persistente (page cache caliente entre reruns)."""
+    c = sqlite3.connect(str(DB_PATH), check_same_thread=False, isolation_level=None, factory=hy.ConexionHY)
+    # WAL + synchronous=NORMAL + busy_timeout, igual que el CLI
+    hy.tune_conn(c)
+    c.row_factory = sqlite3.Row
+    return c
+
+@st.cache_resource
+def write_lock() -> threading.Lock:
+    """Serializa las escrituras sobre la conexión compartida."""
+    return threading.Lock()
+
+def db_mtime() -> float:
+    """Marca de modificación de la BD; se usa como parte de la llave de caché."""
+    # En WAL las escrituras van primero al archivo -wal
+    wal = DB_PATH.with_name(DB_PATH.name + "-wal")
+    mtime = DB_PATH.stat().st_mtime
+    return max(mtime, wal.stat().st_mtime) if wal.exists() else mtime
+
+def invalidate_cache() -> None:
+    """Descarta lecturas cacheadas tras una escritura."""
+    st.cache_data.clear()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_df_cached(desde: str, hasta: str, equipo: str, responsable: str, tipo: str, mtime: float) -> pd.DataFrame:
+    c = get_conn()
+    cols = hy.get_columns(c, "distribucion_hyundai_equipos")
+
+    where = []
+    params = []
+    if desde:
+        where.append("fecha >= ?")
+        params.append(desde)
+    if hasta:
+        where.append("fecha <= ?")
+        params.append(hasta)
+    if equipo:
+        equipos = hy.equipos_que_contienen(c, equipo)
+        where.append(f"equipo_up IN ({', '.join(['?'] * len(equipos))})")
+        params.extend(equipos)
+    if responsable:
+        responsables = hy.responsables_que_contienen(c, responsable)
+        where.append(f"responsable IN ({', '.join(['?'] * len(responsables))})")
+        params.extend(responsables)
+    if tipo and tipo != "TODOS":
+        where.append("tipo_registro = ?")
+        params.append(tipo)
+
+    # La secuencia del contador (si en BD hay NULL) se deriva en SQLite
+    sql = hy.sql_secuencia_contador(cols, " AND ".join(where), orden="fecha DESC, hora DESC, id DESC")
+    return hy.leer_df(c, sql, params)
 
 def fetch_df(filters: dict) -> pd.DataFrame:
-    with conn() as c:
-        cols = hy.get_columns(c, "distribucion_hyundai_equipos")
-
-        where = []
-        params = []
-        if filters.get("desde"):
-            where.append("fecha >= ?")
-            params.append(filters["desde"])
-        if filters.get("hasta"):
-            where.append("fecha <= ?")
-            params.append(filters["hasta"])
-        if filters.get("equipo"):
-            where.append("equipo LIKE ?")
-            params.append(f"%{filters['equipo'].strip().upper()}%")
-        if filters.get("responsable"):
-            where.append("responsable LIKE ?")
-            params.append(f"%{filters['responsable'].strip()}%")
-        if filters.get("tipo") and filters["tipo"] != "TODOS":
-            where.append("tipo_registro = ?")
-            params.append(filters["tipo"])
-
-        sql = f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos"
-        if where:
-            sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY fecha DESC, hora DESC, id DESC"
-
-        df = pd.read_sql_query(sql, c, params=params)
-
-    df = hy.normalize_df_columns(df)
-    df = hy.aplicar_secuencia_contador(df)  # rellena secuencia si en BD hay NULL
+    return _fetch_df_cached(
+        filters.get("desde") or "",
+        filters.get("hasta") or "",
+        filters.get("equipo") or "",
+        filters.get("responsable") or "",
+        filters.get("tipo") or "",
+        db_mtime(),
+    )
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_mes_df_cached(mes: str, mtime: float) -> pd.DataFrame:
+    c = get_conn()
+    sql = f"{hy.select_registros(c)} WHERE fecha >= ? AND fecha < ? ORDER BY {hy.ORDEN_MES_SQL}"
+    df = hy.leer_df(c, sql, hy.rango_mes(mes))
+
+    df = hy.aplicar_secuencia_contador(df, ordenado=True)
     return df
 
-def last_contador_final() -> float:
-    with conn() as c:
-        return hy.fetch_last_contador_final(c)
+def fetch_mes_df(mes: str) -> pd.DataFrame:
+    return _fetch_mes_df_cached(mes, db_mtime())
 
-def last_horometro_final(equipo: str) -> float:
-    with conn() as c:
-        return hy.fetch_last_horometro_final(c, equipo)
+@st.cache_data(ttl=30, show_spinner=False)
+def _last_vals_cached(equipo: str, mtime: float) -> tuple:
+    return hy.fetch_last_valores(get_conn(), equipo)
+
+def last_vals(equipo: str) -> tuple:
+    """(último contador_final global, último horómetro final del equipo)."""
+    return _last_vals_cached(equipo, db_mtime())
 
 def insert_record(data: dict) -> int:
-    with conn() as c:
-        return hy.insert_distribucion(c, data)
+    with write_lock():
+        new_id = hy.insert_distribucion(get_conn(), data)
+    invalidate_cache()
+    return new_id
 
 def update_record(rid: int, data: dict):
-    with conn() as c:
-        hy.update_distribucion(c, rid, data)
+    with write_lock():
+        hy.update_distribucion(get_conn(), rid, data)
+    invalidate_cache()
 
 def delete_record(rid: int) -> bool:
-    with conn() as c:
-        return hy.delete_distribucion(c, rid)
+    with write_lock():
+        ok = hy.delete_distribucion(get_conn(), rid)
+    invalidate_cache()
+    return ok
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _get_by_id_cached(rid: int, mtime: float):
+    return hy.fetch_by_id(get_conn(), rid)
 
 def get_by_id(rid: int):
-    with conn() as c:
-        return hy.fetch_by_id(c, rid)
+    return _get_by_id_cached(rid, db_mtime())
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def df_to_csv_bytes(df_hash: int, _df: pd.DataFrame) -> bytes:
+    # _df no se hashea; la llave es df_hash (contenido del DataFrame)
+    return _df.to_csv(index=False).encode("utf-8-sig")
+
+def df_hash(df: pd.DataFrame) -> int:
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
 
 # -------- UI ----------
 st.title("⛽ HYUNDAI | Distribución a Equipos (Dashboard)")
@@ -137,7 +202,7 @@ with tab_reg:
 
     # Contadores (auto)
     st.markdown("### 📟 Contadores (auto)")
-    ci_default = last_contador_final()
+    ci_default, hi_default = last_vals(equipo_final)
     colx, coly = st.columns([1, 1])
     with colx:
         contador_inicial = st.number_input(
@@ -165,7 +230,6 @@ with tab_reg:
 
     if tipo_registro == "HOROMETRO":
         st.markdown("### ⏱️ Horómetro")
-        hi_default = last_horometro_final(equipo_final)
         c1, c2, c3 = st.columns([1, 1, 1])
         with c1:
             horometro_inicial = st.number_input(
@@ -255,15 +319,13 @@ with tab_list:
     df = fetch_df(dict(desde=desde, hasta=hasta, equipo=equipo_f, responsable=responsable_f, tipo=tipo_f))
 
     st.caption(f"Registros: {len(df)}")
-    show_cols = [c for c in [
-        "id","fecha","hora","equipo","litros_despachados","volumen_despachado","responsable",
-        "contador_inicial_show","contador_final_show","Secuencia_Contador","Delta_Litros","tipo_registro",
-        "horometro_inicial","horometro_final","horas_trabajadas","consumo_por_gl_h","precio_diesel","costo_diesel_usd"
-    ] if c in df.columns]
+    df_cols = frozenset(df.columns)
+    show_cols = [c for c in SHOW_COLS_CANDIDATE if c in df_cols]
+    df_show = df[show_cols]
 
-    st.dataframe(df[show_cols], use_container_width=True, height=520)
+    st.dataframe(df_show, use_container_width=True, height=520)
 
-    csv = df[show_cols].to_csv(index=False).encode("utf-8-sig")
+    csv = df_to_csv_bytes(df_hash(df_show), df_show)
     st.download_button(
         "⬇️ Descargar CSV",
         data=csv,
@@ -279,7 +341,13 @@ with tab_edit:
     st.subheader("✏️ Editar / 🗑️ Eliminar")
 
     rid = st.number_input("ID", min_value=1, step=1, key="edit_rid")
-    rec = get_by_id(int(rid)) if rid else None
+    # El registro se guarda en session_state: mientras no cambie el ID (ni la BD),
+    # los reruns por cada número editado no vuelven a consultar.
+    edit_key = (int(rid), db_mtime()) if rid else None
+    if st.session_state.get("edit_loaded_key") != edit_key:
+        st.session_state["edit_rec"] = get_by_id(int(rid)) if rid else None
+        st.session_state["edit_loaded_key"] = edit_key
+    rec = st.session_state["edit_rec"]
 
     if not rec:
         st.info("Escribe un ID y se cargará el registro.")
@@ -421,26 +489,22 @@ with tab_export:
         elif not TEMPLATE_XLSX.exists():
             st.error("No encuentro la plantilla .xlsx. Colócala en la misma carpeta del app.")
         else:
-            with conn() as c:
-                cols = hy.get_columns(c, "distribucion_hyundai_equipos")
-                sql = f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos WHERE fecha LIKE ? ORDER BY fecha ASC, hora ASC, id ASC"
-                df = pd.read_sql_query(sql, c, params=[f"{mes}-%"])
-
-            df = hy.normalize_df_columns(df)
-            df = hy.aplicar_secuencia_contador(df)
+            df = fetch_mes_df(mes)
 
             if df.empty:
                 st.warning("No hay registros para ese mes.")
             else:
-                out_name = HERE / f"Distribucion_Equipos_{mes}.xlsx"
-                df.to_excel(out_name, index=False)
-                with open(out_name, "rb") as f:
-                    st.download_button(
-                        "⬇️ Descargar Excel",
-                        data=f,
-                        file_name=out_name.name,
-                        key="exp_download_excel"
-                    )
+                # Se arma en memoria: sin escribir ni releer el archivo en disco
+                buf = io.BytesIO()
+                with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"constant_memory": True}}) as w:
+                    df.to_excel(w, index=False, sheet_name="Distribucion_Equipos")
+                st.download_button(
+                    "⬇️ Descargar Excel",
+                    data=buf.getvalue(),
+                    file_name=f"Distribucion_Equipos_{mes}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="exp_download_excel"
+                )
 
 # =======================
 # TAB: Tools
@@ -449,5 +513,7 @@ with tab_tools:
     st.subheader("🧰 Herramientas")
 
     if st.button("🧱 Backfill contadores (llenar NULL)", key="tools_backfill"):
-        hy.backfill_contadores(str(DB_PATH))
+        with write_lock():
+            hy.backfill_contadores(str(DB_PATH))
+        invalidate_cache()
         st.success("Backfill ejecutado ✅ (revisa listado).")
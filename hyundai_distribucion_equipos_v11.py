@@ -21,7 +21,7 @@ Nuevo requisito implementado:
   3) Solo pide confirmar o cambiar el Contador Final antes de guardar
 
 Dependencias:
-    pip install pandas openpyxl
+    pip install pandas openpyxl xlsxwriter
 
 Archivos (por defecto):
 - Base de datos SQLite: control_diesel.db
@@ -32,17 +32,24 @@ Notas:
   "distribucion_hyundai_equipos".
 - Incluye una migración ligera: agrega columnas faltantes si tu tabla es antigua.
 """
+import atexit
+import calendar
 import os
+import queue
 import re
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
+import numpy as np
 import pandas as pd
-import openpyxl
-from copy import copy
 
 
+_RE_DAY = re.compile(r"\d{1,2}")
+_RE_ISO = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
 def parse_fecha_flexible(s: str) -> str:
     """
     Acepta:
@@ -55,20 +62,20 @@ def parse_fecha_flexible(s: str) -> str:
     hoy = datetime.now()
     if s == "":
         return hoy.strftime("%Y-%m-%d")
-    if re.fullmatch(r"\d{1,2}", s):
+    if _RE_DAY.fullmatch(s):
         dia = int(s)
         y, m = hoy.year, hoy.month
         # último día del mes
-        if m == 12:
-            next_month = datetime(y + 1, 1, 1)
-        else:
-            next_month = datetime(y, m + 1, 1)
-        last_day = (next_month - timedelta(days=1)).day
+        last_day = calendar.monthrange(y, m)[1]
         if not (1 <= dia <= last_day):
             raise ValueError(f"Día inválido para el mes actual: {dia} (1..{last_day})")
         return f"{y:04d}-{m:02d}-{dia:02d}"
-    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", s):
-        datetime.strptime(s, "%Y-%m-%d")
+    m_iso = _RE_ISO.fullmatch(s)
+    if m_iso:
+        # validar con los grupos del regex (sin pasar por strptime)
+        y, m, d = (int(g) for g in m_iso.groups())
+        if y < 1 or not (1 <= m <= 12) or not (1 <= d <= calendar.monthrange(y, m)[1]):
+            raise ValueError(f"Fecha inválida: {s}")
         return s
     raise ValueError("Formato inválido. Use YYYY-MM-DD o solo el día (DD).")
 
@@ -79,20 +86,22 @@ TEMPLATE_XLSX = "Distribución de diésel a equipos desde el HYUNDAI_reporte_202
 # =========================
 # Catálogos (ajusta a gusto)
 # =========================
-EQUIPOS = [
+EQUIPOS = (
     "GENERADOR P1 CHICO", "GENERADOR P2", "GENERADOR P1", "BLOWER CISTERNA MOVIL", "CARGADOR SEM 636D", "CAMION AH7922",
     "CARGADOR SEM 639C", "LIMPIEZA P1", "LIMPIEZA P2", "PICK UP CE9798", "PALA DOOSAN", "RETRO JCB RE02", "TORRE DE LUZ RL4000", "CAMION AU8648",
     "CAMION KODIAK AB7045", "PICK UP 967767 AMADOR MANYOMA", "LIMPIEZA BOMBA DE TRASIEGO", "LIMPIEZA VAGON  DE CAMION EP7333",
     "CAMIONSITO DEL DIESEL AB7045", "DISTRIBUIDORA AH1509", "LIMPIEZA DE FILTROS CAMION AU8648", "TANQUE GRIS P1"
-]
+)
 
-EQUIPOS_SIN_HOROMETRO = [
+EQUIPOS_SIN_HOROMETRO = (
     "BLOWER CISTERNA MOVIL", "CAMION AH7922", "CARGADOR SEM 639C", "LIMPIEZA P1", "LIMPIEZA P2", "PICK UP CE9798",
     "TORRE DE LUZ RL4000", "CAMION AU8648", "CAMION KODIAK AB7045", "PICK UP 967767 AMADOR MANYOMA", "LIMPIEZA BOMBA DE TRASIEGO",
     "LIMPIEZA VAGON  DE CAMION EP7333", "CAMIONSITO DEL DIESEL AB7045", "DISTRIBUIDORA AH1509", "LIMPIEZA DE FILTROS CAMION AU8648", "TANQUE GRIS P1"
-]
+)
 
-RESPONSABLES = ["Allan", "Alexander", "Manioma", "Jose", "Banega"]
+EQUIPOS_SIN_HOROMETRO_SET = frozenset(EQUIPOS_SIN_HOROMETRO)
+
+RESPONSABLES = ("Allan", "Alexander", "Manioma", "Jose", "Banega")
 
 
 # =========================
@@ -112,6 +121,32 @@ def pedir_float(msg: str, allow_empty: bool = False, default: Optional[float] =
             print("⚠️ Ingrese un número válido.")
 
 
+def a_float(valor: Any, defecto: Optional[float] = None) -> Optional[float]:
+    """float(valor), o defecto si viene vacío (None / "") o no es un número."""
+    if valor is None or valor == "":
+        return defecto
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+def pedir_float_editar(msg: str, actual: Optional[float], invalido: Optional[float] = None,
+                       aviso: Optional[str] = None) -> Optional[float]:
+    """
+    Número con valor actual/sugerido (editar, contadores): Enter = actual; si no es
+    un número devuelve `invalido` (avisando con `aviso` si se da) sin volver a preguntar.
+    """
+    s = input(msg).strip()
+    if s == "":
+        return actual
+    try:
+        return float(s)
+    except ValueError:
+        if aviso:
+            print(aviso)
+        return invalido
+
+
 def pedir_float_nav(msg: str, allow_empty: bool = False, default: float | None = None):
     while True:
         s = nav_input(msg)
@@ -187,7 +222,7 @@ def interpretar_hora(prompt: str = "🕒 Hora (HH:MM) [Enter = ahora]: ") -> str
         print("⚠️ Hora inválida. Usando ahora.")
         return ahora
 
-def seleccionar_lista(nombre: str, opciones: List[str]) -> str:
+def seleccionar_lista(nombre: str, opciones: Sequence[str]) -> str:
     print(f"\nSeleccione {nombre}:")
     for i, op in enumerate(opciones, 1):
         print(f"  {i}. {op}")
@@ -201,7 +236,7 @@ def seleccionar_lista(nombre: str, opciones: List[str]) -> str:
 
 
 
-def seleccionar_lista_nav(label: str, opciones: list[str]):
+def seleccionar_lista_nav(label: str, opciones: Sequence[str]):
     """Selector con retroceso/cancelación. Devuelve opción elegida o NAV_BACK/NAV_CANCEL."""
     print(f"\nSeleccione {label}:")
     print("  B. ⬅️  Retroceder")
@@ -219,7 +254,7 @@ def seleccionar_lista_nav(label: str, opciones: list[str]):
             if 1 <= idx <= len(opciones):
                 return opciones[idx - 1]
         print("⚠️ Selección inválida.")
-def seleccionar_equipo(opciones: List[str]) -> str:
+def seleccionar_equipo(opciones: Sequence[str]) -> str:
     """
     Selecciona un equipo de la lista, pero permite agregar uno manualmente.
     - Opción 0: escribir equipo manualmente
@@ -245,7 +280,7 @@ def seleccionar_equipo(opciones: List[str]) -> str:
 
 
 
-def seleccionar_equipo_nav(opciones: list[str]):
+def seleccionar_equipo_nav(opciones: Sequence[str]):
     """Como seleccionar_equipo, pero permite retroceder/cancelar."""
     print("\nSeleccione equipo:")
     print("  B. ⬅️  Retroceder")
@@ -270,18 +305,49 @@ def seleccionar_equipo_nav(opciones: list[str]):
             if 1 <= idx <= len(opciones):
                 return str(opciones[idx - 1]).strip().upper()
         print("⚠️ Selección inválida.")
+# Factor usado en todos los registros guardados (no cambiar: volumen_despachado ya se calculó con él)
+GAL_POR_LITRO = 0.264172
+
 def litros_a_gal(litros: float) -> float:
-    return round(litros * 0.264172, 2)
+    return round(litros * GAL_POR_LITRO, 2)
 # =========================
 # Secuencia del contador (derivada)
 # =========================
-def aplicar_secuencia_contador(df: pd.DataFrame) -> pd.DataFrame:
+def _seq_scan(litros: np.ndarray, ci: np.ndarray, cf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Núcleo de la secuencia sobre arrays float64 ya ordenados (NaN = desconocido).
+    Devuelve (contador_inicial_calc, contador_final_calc) redondeados a 2 decimales.
+
+    Cada fila con contador conocido reinicia el tramo; dentro de un tramo el contador
+    final es la semilla del tramo + litros acumulados.
+    """
+    n = litros.shape[0]
+    ci_known = ~np.isnan(ci)
+    cf_known = ~np.isnan(cf)
+    if ci_known.all() and cf_known.all():
+        # Tabla ya rellenada (tras backfill): no hay tramos que reconstruir
+        return np.round(ci, 2), np.round(cf, 2)
+
+    semilla = np.where(cf_known, cf, np.where(ci_known, ci, 0.0))
+    aporte = np.where(cf_known, 0.0, litros)
+    idx = np.arange(n)
+    inicio = np.maximum.accumulate(np.where(ci_known | cf_known, idx, 0))
+    acumulado = np.cumsum(aporte)
+    previo = acumulado[inicio] - aporte[inicio]
+    cf_calc = semilla[inicio] + (acumulado - previo)
+
+    prev_final = np.concatenate(([0.0], cf_calc[:-1]))
+    ci_calc = np.where(ci_known, ci, prev_final)
+    return np.round(ci_calc, 2), np.round(cf_calc, 2)
+
+def aplicar_secuencia_contador(df: pd.DataFrame, ordenado: bool = False) -> pd.DataFrame:
     """
     Construye la secuencia del contador cuando "contador_inicial" / "contador_final"
     vienen en blanco (NULL) en la base de datos.
 
     Reglas:
-      - Ordena por fecha, hora, id (si existen)
+      - Ordena por fecha, hora, id (si existen); con ordenado=True se asume que el
+        DataFrame ya viene en ese orden (ORDER BY ORDEN_SECUENCIA_SQL) y no se reordena
       - Para cada fila:
           contador_inicial_calc = contador_inicial si existe; si no, toma el contador_final_calc anterior (o 0)
           contador_final_calc   = contador_final si existe; si no, contador_inicial_calc + litros_despachados
@@ -297,93 +363,243 @@ def aplicar_secuencia_contador(df: pd.DataFrame) -> pd.DataFrame:
             df[c] = None
 
     sort_cols = [c for c in ["fecha", "hora", "id"] if c in df.columns]
-    if sort_cols:
+    if sort_cols and not ordenado:
         df = df.sort_values(sort_cols).reset_index(drop=True)
 
-    ci_calc = []
-    cf_calc = []
-    prev_final = None
-
-    for _, r in df.iterrows():
-        litros = r.get('litros_despachados')
-        try:
-            litros_val = float(litros)
-        except Exception:
-            litros_val = 0.0
-
-        ci = r.get('contador_inicial')
-        cf = r.get('contador_final')
-
-        ci_valid = None
-        cf_valid = None
-
-        try:
-            if ci is not None and str(ci) != 'nan':
-                ci_valid = float(ci)
-        except Exception:
-            ci_valid = None
-
-        try:
-            if cf is not None and str(cf) != 'nan':
-                cf_valid = float(cf)
-        except Exception:
-            cf_valid = None
-
-        if ci_valid is None:
-            ci_valid = 0.0 if prev_final is None else prev_final
-
-        if cf_valid is None:
-            cf_valid = round(ci_valid + litros_val, 2)
-
-        prev_final = cf_valid
-
-        ci_calc.append(round(ci_valid, 2))
-        cf_calc.append(round(cf_valid, 2))
+    litros = pd.to_numeric(df['litros_despachados'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    ci = pd.to_numeric(df['contador_inicial'], errors='coerce').to_numpy(dtype=float)
+    cf = pd.to_numeric(df['contador_final'], errors='coerce').to_numpy(dtype=float)
+    ci_calc, cf_calc = _seq_scan(litros, ci, cf)
 
     df['contador_inicial_calc'] = ci_calc
     df['contador_final_calc'] = cf_calc
 
-    # Preferir valores reales en BD si existen; si están vacíos, usar los calculados
-    if 'contador_inicial' in df.columns:
-        df['contador_inicial_show'] = df['contador_inicial']
-    else:
-        df['contador_inicial_show'] = None
+    # Preferir valores reales en BD si existen; si vienen NaN/NULL, usar los calculados
+    ci_show = np.where(np.isnan(ci), ci_calc, ci)
+    cf_show = np.where(np.isnan(cf), cf_calc, cf)
+    df['contador_inicial_show'] = ci_show
+    df['contador_final_show'] = cf_show
 
-    if 'contador_final' in df.columns:
-        df['contador_final_show'] = df['contador_final']
-    else:
-        df['contador_final_show'] = None
+    df['Delta_Litros'] = np.round(cf_show - ci_show, 2)
+    ci_txt = np.char.mod('%.2f', ci_show)
+    cf_txt = np.char.mod('%.2f', cf_show)
+    df['Secuencia_Contador'] = np.char.add(np.char.add(ci_txt, ' → '), cf_txt).astype(object)
+    return df
 
-    # Si vienen NaN/NULL, reemplazar por *_calc
-    df['contador_inicial_show'] = df['contador_inicial_show'].where(~df['contador_inicial_show'].isna(), df['contador_inicial_calc'])
-    df['contador_final_show'] = df['contador_final_show'].where(~df['contador_final_show'].isna(), df['contador_final_calc'])
 
-    df['Delta_Litros'] = (df['contador_final_show'] - df['contador_inicial_show']).round(2)
-    df['Secuencia_Contador'] = df['contador_inicial_show'].map(lambda x: f"{float(x):.2f}") + ' → ' + df['contador_final_show'].map(lambda x: f"{float(x):.2f}")
-    return df
 
+# Mismo orden que aplicar_secuencia_contador (pandas deja los NULL de fecha/hora al final)
+ORDEN_SECUENCIA_SQL = "fecha IS NULL, fecha, hora IS NULL, hora, id"
+# El mismo orden cuando el WHERE ya excluye fecha NULL (rango de mes): coincide
+# término a término con idx_dist_fecha_orden y SQLite lo lee del índice sin ordenar
+ORDEN_MES_SQL = "fecha, hora IS NULL, hora, id"
+
+def sql_secuencia_contador(cols: List[str], where: str = "", orden: str = ORDEN_SECUENCIA_SQL) -> str:
+    """
+    Arma un SELECT que deriva en SQLite (funciones de ventana, >= 3.25) las mismas
+    columnas que aplicar_secuencia_contador, sin pasar por Python:
+      contador_inicial_calc / contador_final_calc, *_show, Delta_Litros y Secuencia_Contador.
+
+    - where: condición SQL opcional (sin la palabra WHERE), con placeholders "?".
+    - orden: ORDER BY de la salida (la secuencia siempre se calcula en orden ascendente);
+      "" = sin ORDER BY (p. ej. como subconsulta del backfill).
+    - Cada fila con contador conocido reinicia el tramo; dentro del tramo el contador
+      final es la semilla + litros acumulados.
+    """
+    where_sql = f" WHERE {where}" if where else ""
+    return f"""
+        WITH base AS (
+            SELECT {columnas_select(cols)},
+                   COALESCE(CAST(litros_despachados AS REAL), 0.0) AS _litros,
+                   COUNT(CASE WHEN contador_inicial IS NOT NULL OR contador_final IS NOT NULL THEN 1 END)
+                       OVER (ORDER BY {ORDEN_SECUENCIA_SQL} ROWS UNBOUNDED PRECEDING) AS _tramo
+            FROM distribucion_hyundai_equipos{where_sql}
+        ),
+        cadena AS (
+            SELECT *,
+                   FIRST_VALUE(COALESCE(contador_final, contador_inicial, 0.0)) OVER tramo
+                   + SUM(CASE WHEN contador_final IS NULL THEN _litros ELSE 0.0 END) OVER tramo AS _cf
+            FROM base
+            WINDOW tramo AS (PARTITION BY _tramo ORDER BY {ORDEN_SECUENCIA_SQL} ROWS UNBOUNDED PRECEDING)
+        ),
+        calc AS (
+            SELECT *,
+                   ROUND(COALESCE(contador_inicial, LAG(_cf, 1, 0.0) OVER (ORDER BY {ORDEN_SECUENCIA_SQL})), 2) AS contador_inicial_calc,
+                   ROUND(_cf, 2) AS contador_final_calc
+            FROM cadena
+        ),
+        vista AS (
+            SELECT *,
+                   COALESCE(contador_inicial, contador_inicial_calc) AS contador_inicial_show,
+                   COALESCE(contador_final, contador_final_calc) AS contador_final_show
+            FROM calc
+        )
+        SELECT {columnas_select(cols)},
+               contador_inicial_calc, contador_final_calc,
+               contador_inicial_show, contador_final_show,
+               ROUND(contador_final_show - contador_inicial_show, 2) AS Delta_Litros,
+               printf('%.2f → %.2f', contador_inicial_show, contador_final_show) AS Secuencia_Contador
+        FROM vista
+        {f"ORDER BY {orden}" if orden else ""}
+    """
 
 
 # =========================
 # DB helpers
 # =========================
-def connect(db_path: str) -> sqlite3.Connection:
-    return sqlite3.connect(db_path)
+# Se incrementa en ensure_schema: invalida el caché de columnas de todas las conexiones
+_SCHEMA_GEN = 0
+
+class ConexionHY(sqlite3.Connection):
+    """
+    sqlite3.Connection con caché del esquema: get_columns / column_map no repiten
+    PRAGMA table_info en cada insert/update/fetch. El caché vive con la conexión.
+    """
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.schema_cache: Dict[str, Tuple[int, List[str], Dict[str, str]]] = {}
+        # SQL armado a partir del esquema (p. ej. INSERT por juego de claves)
+        self.sql_cache: Dict[Any, Any] = {}
+
+def tune_conn(conn: sqlite3.Connection) -> None:
+    """PRAGMAs comunes del CLI y del dashboard, una vez por conexión abierta."""
+    # WAL + synchronous=NORMAL: un solo fsync por transacción (seguro en WAL)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    # esperar al otro escritor (CLI vs dashboard) en vez de fallar con SQLITE_BUSY
+    conn.execute("PRAGMA busy_timeout=5000")
+
+def connect(db_path: str, **kwargs: Any) -> sqlite3.Connection:
+    # sentencias preparadas reutilizadas por texto SQL durante toda la sesión
+    kwargs.setdefault("cached_statements", 256)
+    conn = sqlite3.connect(db_path, factory=ConexionHY, **kwargs)
+    tune_conn(conn)
+    return conn
+
+# Una conexión por base para toda la sesión del CLI (se cierra al salir)
+_CONEXIONES: Dict[str, sqlite3.Connection] = {}
+
+def get_conn(db_path: str) -> sqlite3.Connection:
+    """
+    Conexión compartida (singleton por ruta) en vez de abrir una nueva por cada opción
+    del menú. check_same_thread=False: el módulo también se usa desde Streamlit.
+    """
+    key = os.path.abspath(db_path)
+    conn = _CONEXIONES.get(key)
+    if conn is None:
+        conn = connect(db_path, check_same_thread=False)
+        _CONEXIONES[key] = conn
+    return conn
+
+@atexit.register
+def cerrar_conexiones() -> None:
+    while _CONEXIONES:
+        _, conn = _CONEXIONES.popitem()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+@contextmanager
+def transaccion(conn: sqlite3.Connection) -> Iterator[None]:
+    """
+    BEGIN IMMEDIATE ... COMMIT explícito (ROLLBACK si falla).
+    Sirve igual con isolation_level=None (autocommit) que con el modo por defecto;
+    si ya hay una transacción abierta, se une a ella.
+    """
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
 def table_exists(conn: sqlite3.Connection, table: str) -> bool:
     cur = conn.cursor()
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
     return cur.fetchone() is not None
 
-def get_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+def _schema(conn: sqlite3.Connection, table: str) -> Tuple[List[str], Dict[str, str]]:
+    """(columnas, mapa lower->real) de la tabla; cacheado si la conexión es ConexionHY."""
+    cache = getattr(conn, "schema_cache", None)
+    if cache is not None:
+        hit = cache.get(table)
+        if hit is not None and hit[0] == _SCHEMA_GEN:
+            return hit[1], hit[2]
     cur = conn.cursor()
     cur.execute(f"PRAGMA table_info({table})")
-    return [r[1] for r in cur.fetchall()]
+    cols = [r[1] for r in cur.fetchall()]
+    cmap = {c.lower(): c for c in cols}
+    if cache is not None:
+        cache[table] = (_SCHEMA_GEN, cols, cmap)
+    return cols, cmap
+
+def get_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return list(_schema(conn, table)[0])
 
 def column_map(conn: sqlite3.Connection, table: str) -> Dict[str, str]:
     """Mapa case-insensitive: lower_name -> actual_name en SQLite."""
-    cols = get_columns(conn, table)
-    return {c.lower(): c for c in cols}
+    return dict(_schema(conn, table)[1])
+
+# Tipos conocidos (nombre en minúscula) para armar DataFrames sin inferencia
+COL_DTYPES = {
+    "id": "int64",
+    "volumen_despachado": "float64",
+    "litros_despachados": "float64",
+    "horometro_inicial": "float64",
+    "horometro_final": "float64",
+    "horas_trabajadas": "float64",
+    "consumo_por_gl_h": "float64",
+    "precio_diesel": "float64",
+    "costo_diesel_usd": "float64",
+    "contador_inicial": "float64",
+    "contador_final": "float64",
+    "volumen_restante_hyundai": "float64",
+    "contador_inicial_calc": "float64",
+    "contador_final_calc": "float64",
+    "contador_inicial_show": "float64",
+    "contador_final_show": "float64",
+    "delta_litros": "float64",
+    # texto con pocos valores distintos
+    "equipo": "category",
+    "responsable": "category",
+    "tipo_registro": "category",
+}
+
+def leer_df(conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] | List[Any] = ()) -> pd.DataFrame:
+    """
+    Equivalente liviano a pd.read_sql_query: fetchall + arrays NumPy por columna.
+    Las columnas de COL_DTYPES se construyen directo con su tipo (NULL -> NaN;
+    category para textos repetidos); si una numérica trae texto, queda como object.
+    """
+    cur = conn.execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+    arrays = list(zip(*rows)) if rows else [()] * len(cols)
+    data: Dict[str, Any] = {}
+    for col, vals in zip(cols, arrays):
+        dt = COL_DTYPES.get(col.lower())
+        try:
+            if dt == "category":
+                data[col] = pd.Categorical(vals)
+            else:
+                data[col] = np.asarray(vals, dtype=dt) if dt else list(vals)
+        except (TypeError, ValueError):
+            data[col] = list(vals)
+    return pd.DataFrame(data, columns=cols)
+
+# nombre en minúsculas -> nombre normalizado
+# (contadores: en tu DB existen como Contador_inicial / Contador_final)
+_NORMALIZE = {
+    "contador_inicial": "contador_inicial",
+    "contador_final": "contador_final",
+}
 
 def normalize_df_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Normaliza nombres de columnas comunes para evitar problemas de mayúsculas/minúsculas."""
@@ -391,28 +607,51 @@ def normalize_df_columns(df: pd.DataFrame) -> pd.DataFrame:
         return df
     rename = {}
     for c in df.columns:
-        cl = str(c).lower()
-        # Contadores (en tu DB existen como Contador_inicial / Contador_final)
-        if cl == "contador_inicial":
-            rename[c] = "contador_inicial"
-        elif cl == "contador_final":
-            rename[c] = "contador_final"
+        destino = _NORMALIZE.get(str(c).lower())
+        if destino is not None and c != destino:
+            rename[c] = destino
     if rename:
         df = df.rename(columns=rename)
     return df
 
 
+def columnas_select(cols: Sequence[str]) -> str:
+    """
+    Lista para SELECT con los alias de _NORMALIZE (Contador_inicial AS contador_inicial):
+    el DataFrame sale ya normalizado y no hace falta renombrar después.
+    """
+    partes = []
+    for c in cols:
+        destino = _NORMALIZE.get(c.lower())
+        partes.append(f"{c} AS {destino}" if destino is not None and c != destino else c)
+    return ", ".join(partes)
+
+
+# Bases ya verificadas en este proceso (el dashboard y backfill_contadores lo llaman en cada uso)
+_SCHEMA_LISTO: Set[str] = set()
+
 def ensure_schema(db_path: str) -> None:
     """
     Asegura que exista la tabla distribucion_hyundai_equipos con columnas necesarias.
     - Si la tabla ya existe, agrega columnas faltantes.
     - Si no existe, la crea con un esquema compatible.
     """
-    with connect(db_path) as conn:
+    global _SCHEMA_GEN
+    key = os.path.abspath(db_path)
+    if key in _SCHEMA_LISTO and os.path.exists(key):
+        return
+    if _ensure_schema(db_path):
+        # Cambiaron las columnas (CREATE/ALTER TABLE): invalidar columnas cacheadas
+        _SCHEMA_GEN += 1
+    _SCHEMA_LISTO.add(key)
+
+def _ensure_schema(db_path: str) -> bool:
+    """Hace el trabajo de ensure_schema; devuelve True si creó/agregó columnas."""
+    with get_conn(db_path) as conn:
         cur = conn.cursor()
 
         if not table_exists(conn, "distribucion_hyundai_equipos"):
-            cur.execute("""
+            cur.execute(f"""
                 CREATE TABLE distribucion_hyundai_equipos (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     fecha TEXT,
@@ -432,13 +671,17 @@ def ensure_schema(db_path: str) -> None:
                     contador_inicial REAL,          -- litros (contador/meter)
                     contador_final REAL,            -- litros
                     volumen_restante_hyundai REAL,  -- gal (si lo usas)
-                    tipo_registro TEXT              -- HOROMETRO / SIN_HOROMETRO
+                    tipo_registro TEXT,             -- HOROMETRO / SIN_HOROMETRO
+                    {EQUIPO_UP_DDL}                 -- equipo en mayúscula (indexado)
                 )
             """)
+            crear_indices(cur)
             conn.commit()
-            return
+            return True
 
-        cols = set(get_columns(conn, "distribucion_hyundai_equipos"))
+        # table_xinfo incluye también la columna generada equipo_up (table_info no);
+        # SQLite compara nombres sin distinguir mayúsculas (Contador_inicial == contador_inicial)
+        cols = {str(r[1]).lower() for r in cur.execute("PRAGMA table_xinfo(distribucion_hyundai_equipos)").fetchall()}
         desired = [
             ("hora", "TEXT"),
             ("litros_despachados", "REAL"),
@@ -454,118 +697,250 @@ def ensure_schema(db_path: str) -> None:
             ("tipo_registro", "TEXT"),
         ]
 
-        for name, typ in desired:
-            if name not in cols:
+        to_add = [(name, typ) for name, typ in desired if name not in cols]
+        falta_equipo_up = "equipo_up" not in cols
+        existentes = {r[0] for r in cur.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='distribucion_hyundai_equipos'"
+        ).fetchall()}
+        faltan_idx = [ix for ix in INDICES if ix[0] not in existentes]
+        if not to_add and not falta_equipo_up and not faltan_idx:
+            # Esquema al día: ni ALTER ni commit
+            return False
+
+        # Todo lo que falte en una sola transacción
+        changed = False
+        with transaccion(conn):
+            for name, typ in to_add:
                 try:
                     cur.execute(f"ALTER TABLE distribucion_hyundai_equipos ADD COLUMN {name} {typ}")
+                    changed = True
                 except Exception:
                     pass
-        conn.commit()
+            if falta_equipo_up:
+                cur.execute(f"ALTER TABLE distribucion_hyundai_equipos ADD COLUMN {EQUIPO_UP_DDL}")
+            crear_indices(cur, faltan_idx)
+        return changed
+
+# UPPER(equipo) como columna generada VIRTUAL (SQLite >= 3.31) para poder indexarla
+EQUIPO_UP_DDL = "equipo_up TEXT GENERATED ALWAYS AS (UPPER(equipo)) VIRTUAL"
+
+# (nombre, columnas, WHERE del índice parcial o "")
+INDICES = [
+    ("idx_dist_fecha_hora_id", "fecha, hora, id", ""),
+    ("idx_dist_fecha_orden", "fecha, hora IS NULL, hora, id", ""),
+    ("idx_dist_equipo", "equipo", ""),
+    ("idx_dist_equipo_up", "equipo_up", ""),
+    ("idx_dist_tipo", "tipo_registro", ""),
+    ("idx_dist_responsable", "responsable", ""),
+    # Parciales para los "último valor" (fetch_last_*): LIMIT 1 directo del índice, sin ordenar
+    ("idx_dist_ultimo_contador", "fecha, hora, id", "contador_final IS NOT NULL"),
+    ("idx_dist_equipo_ultimo_horometro", "equipo, fecha, hora, id", "horometro_final IS NOT NULL"),
+]
+
+def crear_indices(cur: sqlite3.Cursor, indices: Sequence[Tuple[str, str, str]] = INDICES) -> None:
+    """Índices para filtros/orden de listados y exportación (evita full scans)."""
+    for name, cols, where in indices:
+        where_sql = f" WHERE {where}" if where else ""
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON distribucion_hyundai_equipos({cols}){where_sql}")
+
+def equipos_que_contienen(conn: sqlite3.Connection, texto: str) -> List[str]:
+    """
+    Valores de equipo_up que contienen `texto` (sin distinguir mayúsculas).
+    Lee solo los valores distintos desde idx_dist_equipo_up, así el filtro
+    "equipo contiene" se resuelve con equipo_up IN (...) sobre el índice en vez
+    de un LIKE '%...%' que recorre toda la tabla.
+    """
+    t = (texto or "").strip().upper()
+    cur = conn.execute("SELECT DISTINCT equipo_up FROM distribucion_hyundai_equipos WHERE equipo_up IS NOT NULL")
+    return [r[0] for r in cur.fetchall() if t in r[0]]
+
+def responsables_que_contienen(conn: sqlite3.Connection, texto: str) -> List[str]:
+    """
+    Igual que equipos_que_contienen, para "responsable contiene": valores distintos
+    desde idx_dist_responsable y responsable IN (...) en vez de LIKE '%...%'.
+    """
+    t = (texto or "").strip().upper()
+    cur = conn.execute("SELECT DISTINCT responsable FROM distribucion_hyundai_equipos WHERE responsable IS NOT NULL")
+    return [r[0] for r in cur.fetchall() if t in str(r[0]).upper()]
+
+def rango_mes(mes: str) -> Tuple[str, str]:
+    """
+    'YYYY-MM' -> (desde, hasta) para filtrar con fecha >= desde AND fecha < hasta.
+    Equivale a fecha LIKE 'YYYY-MM-%' pero SQLite puede usar el índice de fecha
+    ('.' es el carácter siguiente a '-').
+    """
+    return f"{mes}-", f"{mes}."
 
 def fetch_last_contador_final(conn: sqlite3.Connection) -> float:
-    """Último contador_final GLOBAL registrado."""
-    cols = set(get_columns(conn, "distribucion_hyundai_equipos"))
-    cur = conn.cursor()
-    if "fecha" in cols and "hora" in cols:
-        cur.execute("""
-            SELECT contador_final
-            FROM distribucion_hyundai_equipos
-            WHERE contador_final IS NOT NULL
-            ORDER BY fecha DESC, hora DESC, id DESC
-            LIMIT 1
-        """)
-    else:
-        cur.execute("""
-            SELECT contador_final
-            FROM distribucion_hyundai_equipos
-            WHERE contador_final IS NOT NULL
-            ORDER BY id DESC
-            LIMIT 1
-        """)
-    row = cur.fetchone()
+    """Último contador_final GLOBAL registrado (fecha/hora siempre existen tras ensure_schema)."""
+    row = conn.execute("""
+        SELECT contador_final
+        FROM distribucion_hyundai_equipos
+        WHERE contador_final IS NOT NULL
+        ORDER BY fecha DESC, hora DESC, id DESC
+        LIMIT 1
+    """).fetchone()
     return round(float(row[0]), 2) if row and row[0] is not None else 0.0
 
 def fetch_last_horometro_final(conn: sqlite3.Connection, equipo: str) -> float:
     """Último horometro_final del equipo (para horómetro inicial por defecto)."""
-    cols = set(get_columns(conn, "distribucion_hyundai_equipos"))
-    cur = conn.cursor()
-    if "fecha" in cols and "hora" in cols:
-        cur.execute("""
-            SELECT horometro_final
-            FROM distribucion_hyundai_equipos
-            WHERE equipo = ? AND horometro_final IS NOT NULL
-            ORDER BY fecha DESC, hora DESC, id DESC
-            LIMIT 1
-        """, (equipo,))
-    else:
-        cur.execute("""
-            SELECT horometro_final
-            FROM distribucion_hyundai_equipos
-            WHERE equipo = ? AND horometro_final IS NOT NULL
-            ORDER BY id DESC
-            LIMIT 1
-        """, (equipo,))
-    row = cur.fetchone()
+    row = conn.execute("""
+        SELECT horometro_final
+        FROM distribucion_hyundai_equipos
+        WHERE equipo = ? AND horometro_final IS NOT NULL
+        ORDER BY fecha DESC, hora DESC, id DESC
+        LIMIT 1
+    """, (equipo,)).fetchone()
     return round(float(row[0]), 2) if row and row[0] is not None else 0.0
 
+def fetch_last_valores(conn: sqlite3.Connection, equipo: str) -> Tuple[float, float]:
+    """
+    (último contador_final GLOBAL, último horometro_final del equipo) en una sola consulta.
+    Mismo criterio que fetch_last_contador_final / fetch_last_horometro_final.
+    """
+    row = conn.execute("""
+        SELECT
+            (SELECT contador_final
+             FROM distribucion_hyundai_equipos
+             WHERE contador_final IS NOT NULL
+             ORDER BY fecha DESC, hora DESC, id DESC
+             LIMIT 1),
+            (SELECT horometro_final
+             FROM distribucion_hyundai_equipos
+             WHERE equipo = ? AND horometro_final IS NOT NULL
+             ORDER BY fecha DESC, hora DESC, id DESC
+             LIMIT 1)
+    """, (equipo,)).fetchone()
+    cf = round(float(row[0]), 2) if row[0] is not None else 0.0
+    hf = round(float(row[1]), 2) if row[1] is not None else 0.0
+    return cf, hf
+
+def _sql_cacheado(conn: sqlite3.Connection, clave: Tuple[Any, ...], armar: Callable[[], Any]) -> Any:
+    """
+    SQL que depende solo del esquema: se arma una vez por conexión (sql_cache de
+    ConexionHY) y se rehace si ensure_schema cambió columnas. Sin caché en conexiones
+    sqlite3 normales.
+    """
+    cache = getattr(conn, "sql_cache", None)
+    if cache is None:
+        return armar()
+    key = (_SCHEMA_GEN,) + clave
+    if key not in cache:
+        cache[key] = armar()
+    return cache[key]
+
+def select_registros(conn: sqlite3.Connection) -> str:
+    """SELECT de todas las columnas (contadores con alias normalizado), sin WHERE."""
+    return _sql_cacheado(
+        conn,
+        ("select",),
+        lambda: f"SELECT {columnas_select(get_columns(conn, 'distribucion_hyundai_equipos'))} FROM distribucion_hyundai_equipos",
+    )
+
+def sql_export_mes(conn: sqlite3.Connection) -> str:
+    """
+    SELECT del mes a exportar (params: rango_mes), una columna por EXPORT_COLS y en ese
+    orden, ya en orden de secuencia. Los contadores salen de *_show (valor de BD si existe,
+    si no la secuencia calculada en SQLite sobre las filas del mes); columnas que la
+    tabla no tiene salen NULL.
+    """
+    def armar() -> str:
+        cmap = column_map(conn, "distribucion_hyundai_equipos")
+        claves = ["id", "fecha", "hora"] + [c for c, _ in EXPORT_COLS if c not in ("id", "fecha", "hora")]
+        cols = [cmap[c] for c in claves if c in cmap]
+        seq = sql_secuencia_contador(cols, "fecha >= ? AND fecha < ?", orden="")
+        fuente = {"contador_inicial": "contador_inicial_show", "contador_final": "contador_final_show"}
+        proyeccion = ", ".join(
+            fuente[c] if c in fuente else (c if c in cmap else f"NULL AS {c}") for c, _ in EXPORT_COLS
+        )
+        return f"SELECT {proyeccion} FROM ({seq}) ORDER BY {ORDEN_MES_SQL}"
+    return _sql_cacheado(conn, ("export_mes",), armar)
+
+def _plan_insert(conn: sqlite3.Connection, claves: Tuple[str, ...]) -> Tuple[str, Tuple[str, ...]]:
+    """
+    (SQL del INSERT, claves de data en el orden de los "?") para ese juego de claves.
+    Se arma una vez por conexión y esquema; los registrar_* siempre mandan las mismas.
+    """
+    def armar() -> Tuple[str, Tuple[str, ...]]:
+        cmap = column_map(conn, "distribucion_hyundai_equipos")
+        # mapear keys a nombre real de la BD (case-insensitive)
+        usadas: Dict[str, str] = {}
+        for k in claves:
+            kk = str(k).lower()
+            if kk in cmap:
+                usadas[cmap[kk]] = k
+        cols = list(usadas.keys())
+        placeholders = ", ".join(["?"] * len(cols))
+        sql = f"INSERT INTO distribucion_hyundai_equipos ({', '.join(cols)}) VALUES ({placeholders})"
+        return sql, tuple(usadas.values())
+    return _sql_cacheado(conn, ("insert", claves), armar)
+
 def insert_distribucion(conn: sqlite3.Connection, data: Dict[str, Any]) -> int:
-    cmap = column_map(conn, "distribucion_hyundai_equipos")
-    # mapear keys a nombre real de la BD (case-insensitive)
-    data2 = {}
-    for k, v in data.items():
-        kk = str(k).lower()
-        if kk in cmap:
-            data2[cmap[kk]] = v
-    keys = list(data2.keys())
-    placeholders = ", ".join(["?"] * len(keys))
-    sql = f"INSERT INTO distribucion_hyundai_equipos ({', '.join(keys)}) VALUES ({placeholders})"
+    sql, claves = _plan_insert(conn, tuple(data))
     cur = conn.cursor()
-    cur.execute(sql, tuple(data2[k] for k in keys))
-    conn.commit()
+    with transaccion(conn):
+        cur.execute(sql, tuple(data[k] for k in claves))
     return int(cur.lastrowid)
 
+def _plan_update(conn: sqlite3.Connection, claves: Tuple[str, ...]) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """
+    (SQL del UPDATE ... WHERE id=?, claves de data en el orden de los "?"), igual que
+    _plan_insert: mismo texto SQL para el mismo juego de claves (caché de sentencias
+    de sqlite3). SQL None si ninguna clave es columna de la tabla.
+    """
+    def armar() -> Tuple[Optional[str], Tuple[str, ...]]:
+        cmap = column_map(conn, "distribucion_hyundai_equipos")
+        usadas: Dict[str, str] = {}
+        for k in claves:
+            kk = str(k).lower()
+            if kk in cmap:
+                usadas[cmap[kk]] = k
+        if not usadas:
+            return None, ()
+        sets = ", ".join([f"{c}=?" for c in usadas])
+        return f"UPDATE distribucion_hyundai_equipos SET {sets} WHERE id=?", tuple(usadas.values())
+    return _sql_cacheado(conn, ("update", claves), armar)
+
 def update_distribucion(conn: sqlite3.Connection, record_id: int, data: Dict[str, Any]) -> None:
-    cmap = column_map(conn, "distribucion_hyundai_equipos")
-    data2 = {}
-    for k, v in data.items():
-        kk = str(k).lower()
-        if kk in cmap:
-            data2[cmap[kk]] = v
-    if not data2:
+    sql, claves = _plan_update(conn, tuple(data))
+    if sql is None:
         return
-    sets = ", ".join([f"{k}=?" for k in data2.keys()])
-    sql = f"UPDATE distribucion_hyundai_equipos SET {sets} WHERE id=?"
     cur = conn.cursor()
-    cur.execute(sql, tuple(data2.values()) + (record_id,))
-    conn.commit()
+    with transaccion(conn):
+        cur.execute(sql, tuple(data[k] for k in claves) + (record_id,))
 
 def delete_distribucion(conn: sqlite3.Connection, record_id: int) -> bool:
     cur = conn.cursor()
-    cur.execute("DELETE FROM distribucion_hyundai_equipos WHERE id=?", (record_id,))
-    conn.commit()
+    with transaccion(conn):
+        cur.execute("DELETE FROM distribucion_hyundai_equipos WHERE id=?", (record_id,))
     return cur.rowcount > 0
 
 def fetch_by_id(conn: sqlite3.Connection, record_id: int) -> Optional[Dict[str, Any]]:
     cur = conn.cursor()
-    cols = get_columns(conn, "distribucion_hyundai_equipos")
-    cur.execute(f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos WHERE id=?", (record_id,))
+    # Row solo en este cursor (el resto del módulo sigue con tuplas); los contadores
+    # vienen ya con alias en minúsculas (columnas_select), sin re-mapear el dict
+    cur.row_factory = sqlite3.Row
+    sql = _sql_cacheado(conn, ("fetch_by_id",), lambda: f"{select_registros(conn)} WHERE id=?")
+    cur.execute(sql, (record_id,))
     row = cur.fetchone()
-    if not row:
-        return None
-    rec = dict(zip(cols, row))
-    # alias case-insensitive contadores
-    for k in list(rec.keys()):
-        kl = str(k).lower()
-        if kl == 'contador_inicial':
-            rec['contador_inicial'] = rec[k]
-        if kl == 'contador_final':
-            rec['contador_final'] = rec[k]
-    return rec
+    return dict(row) if row else None
 
 
 # =========================
 # Precio diésel (compat)
 # =========================
+# db_name -> (firma del archivo, precio leído o None): solo se vuelve a consultar si cambió
+_PRECIO_CACHE: Dict[str, Tuple[Tuple[int, int], Optional[float]]] = {}
+
+def _firma_archivo(db_name: str) -> Tuple[int, int]:
+    """mtime (ns) de la base y de su -wal (en WAL los commits no tocan el archivo principal)."""
+    mtime = os.stat(db_name).st_mtime_ns
+    try:
+        wal = os.stat(db_name + "-wal").st_mtime_ns
+    except OSError:
+        wal = 0
+    return mtime, wal
+
 def obtener_precio_diesel_actual() -> float:
     """
     Mantiene compatibilidad: intenta leer de reportes_DMI.db o reportes.db.
@@ -573,18 +948,25 @@ def obtener_precio_diesel_actual() -> float:
     """
     consulta = "SELECT precio_diesel FROM {} WHERE precio_diesel IS NOT NULL ORDER BY fecha_produccion DESC LIMIT 1"
     for db_name, table in [("reportes_DMI.db", "reportes_DMI"), ("reportes.db", "reportes")]:
-        if not os.path.exists(db_name):
-            continue
         try:
-            conn = sqlite3.connect(db_name)
-            cur = conn.cursor()
-            cur.execute(consulta.format(table))
-            row = cur.fetchone()
-            conn.close()
-            if row and row[0] is not None:
-                return float(row[0])
-        except Exception:
-            pass
+            firma = _firma_archivo(db_name)
+        except OSError:
+            continue
+        cache = _PRECIO_CACHE.get(db_name)
+        if cache is not None and cache[0] == firma:
+            precio = cache[1]
+        else:
+            precio = None
+            try:
+                with closing(sqlite3.connect(db_name)) as conn:
+                    row = conn.execute(consulta.format(table)).fetchone()
+                if row and row[0] is not None:
+                    precio = float(row[0])
+            except Exception:
+                pass
+            _PRECIO_CACHE[db_name] = (firma, precio)
+        if precio is not None:
+            return precio
     return 2.7955
 
 
@@ -594,26 +976,15 @@ def obtener_precio_diesel_actual() -> float:
 def pedir_contadores_auto(conn: sqlite3.Connection, litros_despachados: float) -> Tuple[float, float]:
     contador_inicial_default = fetch_last_contador_final(conn)
 
-    entrada_ci = pedir_texto(f"📟 Contador inicial (litros) [{contador_inicial_default}]: ",
-                            allow_empty=True, default=str(contador_inicial_default))
-    try:
-        contador_inicial = float(entrada_ci) if entrada_ci is not None else contador_inicial_default
-    except ValueError:
-        print("⚠️ Contador inicial inválido. Usando el valor por defecto.")
-        contador_inicial = contador_inicial_default
+    contador_inicial = pedir_float_editar(
+        f"📟 Contador inicial (litros) [{contador_inicial_default}]: ", contador_inicial_default,
+        invalido=contador_inicial_default, aviso="⚠️ Contador inicial inválido. Usando el valor por defecto.")
 
     contador_final_calc = round(contador_inicial + litros_despachados, 2)
 
-    entrada_cf = pedir_texto(
-        f"📟 Contador final calculado = {contador_final_calc} (Enter para aceptar / escribe otro): ",
-        allow_empty=True,
-        default=str(contador_final_calc),
-    )
-    try:
-        contador_final = float(entrada_cf) if entrada_cf is not None else contador_final_calc
-    except ValueError:
-        print("⚠️ Contador final inválido. Se usará el calculado.")
-        contador_final = contador_final_calc
+    contador_final = pedir_float_editar(
+        f"📟 Contador final calculado = {contador_final_calc} (Enter para aceptar / escribe otro): ", contador_final_calc,
+        invalido=contador_final_calc, aviso="⚠️ Contador final inválido. Se usará el calculado.")
 
     return round(contador_inicial, 2), round(contador_final, 2)
 
@@ -625,11 +996,66 @@ def pedir_contadores_auto(conn: sqlite3.Connection, litros_despachados: float) -
 # =========================
 # Backfill: guardar secuencia de contador en BD
 # =========================
+# UPDATE ... FROM existe desde SQLite 3.33; antes se usa el camino NumPy + executemany
+_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
+
+def _backfill_sql(conn: sqlite3.Connection, cmap: Dict[str, str]) -> int:
+    """
+    Backfill en una sola sentencia: la misma secuencia de sql_secuencia_contador,
+    escrita solo donde falta algún contador. Devuelve filas actualizadas.
+    """
+    secuencia = sql_secuencia_contador(
+        ["id", "fecha", "hora", cmap["contador_inicial"], cmap["contador_final"]], orden=""
+    )
+    with transaccion(conn):
+        cur = conn.execute(
+            f"""UPDATE distribucion_hyundai_equipos AS t
+                SET {cmap['contador_inicial']} = x.contador_inicial_calc,
+                    {cmap['contador_final']} = x.contador_final_calc
+                FROM ({secuencia}) AS x
+                WHERE t.id = x.id
+                  AND (t.{cmap['contador_inicial']} IS NULL OR t.{cmap['contador_final']} IS NULL)"""
+        )
+    return cur.rowcount
+
+def _backfill_numpy(conn: sqlite3.Connection, cmap: Dict[str, str]) -> int:
+    """
+    Respaldo para SQLite < 3.33: lee solo las columnas de la secuencia, calcula con
+    _seq_scan y escribe con un executemany. (Un UPDATE con subconsulta correlacionada
+    recalcularía las ventanas por cada fila.)
+    """
+    df = leer_df(
+        conn,
+        f"""SELECT id, litros_despachados,
+                   {cmap['contador_inicial']} AS contador_inicial,
+                   {cmap['contador_final']} AS contador_final
+            FROM distribucion_hyundai_equipos
+            ORDER BY {ORDEN_SECUENCIA_SQL}"""
+    )
+    litros = pd.to_numeric(df["litros_despachados"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    ci_db = pd.to_numeric(df["contador_inicial"], errors="coerce").to_numpy(dtype=float)
+    cf_db = pd.to_numeric(df["contador_final"], errors="coerce").to_numpy(dtype=float)
+    ci_calc, cf_calc = _seq_scan(litros, ci_db, cf_db)
+
+    needs = np.isnan(ci_db) | np.isnan(cf_db)
+    params = list(zip(
+        ci_calc[needs].tolist(),
+        cf_calc[needs].tolist(),
+        df["id"].to_numpy(dtype=np.int64)[needs].tolist(),
+    ))
+    if params:
+        with transaccion(conn):
+            conn.executemany(
+                f"UPDATE distribucion_hyundai_equipos SET {cmap['contador_inicial']}=?, {cmap['contador_final']}=? WHERE id=?",
+                params
+            )
+    return len(params)
+
 def backfill_contadores(db_path: str) -> None:
     """
     Llena (solo donde están NULL) los campos contador_inicial y contador_final en la BD,
     siguiendo la secuencia en el ORDEN REAL de la base:
-      ORDER BY fecha ASC, hora ASC, id ASC
+      ORDER BY fecha ASC, hora ASC (vacía al final), id ASC
 
     Importante:
     - Si un registro YA tiene contador_inicial/contador_final, se respetan.
@@ -638,7 +1064,7 @@ def backfill_contadores(db_path: str) -> None:
         contador_final   = contador_inicial + litros_despachados
     """
     ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         cols = get_columns(conn, "distribucion_hyundai_equipos")
         if "litros_despachados" not in cols:
             print("⚠️ Tu tabla no tiene 'litros_despachados'. No puedo reconstruir contadores.")
@@ -648,43 +1074,27 @@ def backfill_contadores(db_path: str) -> None:
             print("⚠️ Tu tabla no tiene columnas de contador.")
             return
 
-        df = pd.read_sql_query(
-            f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos ORDER BY fecha ASC, hora ASC, id ASC",
-            conn
-        )
-        df = normalize_df_columns(df)
-        if df.empty:
+        # Sin NULL en los contadores no hay nada que reconstruir: no leer la tabla
+        hay, faltan = conn.execute(
+            f"""SELECT EXISTS(SELECT 1 FROM distribucion_hyundai_equipos),
+                       EXISTS(SELECT 1 FROM distribucion_hyundai_equipos
+                              WHERE {cmap['contador_inicial']} IS NULL OR {cmap['contador_final']} IS NULL)"""
+        ).fetchone()
+        if not hay:
             print("📭 No hay registros.")
             return
+        if not faltan:
+            print("✅ Backfill completo. Registros actualizados: 0")
+            return
 
-        df = aplicar_secuencia_contador(df)
-
-        # Actualizar solo filas donde contador_inicial o contador_final están NULL
-        cur = conn.cursor()
-        updated_rows = 0
-        for _, r in df.iterrows():
-            rid = int(r["id"])
-            ci_db = r.get("contador_inicial")
-            cf_db = r.get("contador_final")
-
-            needs = (ci_db is None) or (cf_db is None) or (str(ci_db) == "nan") or (str(cf_db) == "nan")
-            if not needs:
-                continue
-
-            ci = float(r["contador_inicial_calc"])
-            cf = float(r["contador_final_calc"])
-            cur.execute(
-                f"UPDATE distribucion_hyundai_equipos SET {cmap['contador_inicial']}=?, {cmap['contador_final']}=? WHERE id=?",
-                (ci, cf, rid)
-            )
-            updated_rows += 1
-
-        conn.commit()
+        if _UPDATE_FROM:
+            updated_rows = _backfill_sql(conn, cmap)
+        else:
+            updated_rows = _backfill_numpy(conn, cmap)
         print(f"✅ Backfill completo. Registros actualizados: {updated_rows}")
 
 def registrar_con_horometro(db_path: str) -> None:
-    ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         print("\n🛠️ REGISTRAR DISTRIBUCIÓN (CON HORÓMETRO)")
         state: dict = {}
 
@@ -845,8 +1255,7 @@ def registrar_con_horometro(db_path: str) -> None:
 
 
 def registrar_sin_horometro(db_path: str) -> None:
-    ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         print("\n🛠️ REGISTRAR DISTRIBUCIÓN (SIN HORÓMETRO)")
         state: dict = {}
 
@@ -979,9 +1388,11 @@ def registrar_sin_horometro(db_path: str) -> None:
         print(f"💰 Costo estimado: ${costo:.2f}" if costo is not None else "💰 Costo estimado: N/A")
 
 
+# Filas por página en listar
+LISTAR_PAGINA = 200
+
 def listar(db_path: str) -> None:
-    ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         cols = get_columns(conn, "distribucion_hyundai_equipos")
 
         print("\n🔎 LISTAR REGISTROS (filtros opcionales)")
@@ -1000,38 +1411,60 @@ def listar(db_path: str) -> None:
             where.append("fecha <= ?")
             params.append(hasta)
         if equipo:
-            where.append("equipo LIKE ?")
-            params.append(f"%{equipo.strip().upper()}%")
+            equipos = equipos_que_contienen(conn, equipo)
+            where.append(f"equipo_up IN ({', '.join(['?'] * len(equipos))})")
+            params.extend(equipos)
         if responsable:
-            where.append("responsable LIKE ?")
-            params.append(f"%{responsable.strip()}%")
-
-        sql = f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos"
-        if where:
-            sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY fecha DESC, hora DESC, id DESC"
-
-        df = pd.read_sql_query(sql, conn, params=params)
-        df = normalize_df_columns(df)
-
-        # aplicar secuencia del contador (si viene en blanco en BD)
-        df = aplicar_secuencia_contador(df)
+            responsables = responsables_que_contienen(conn, responsable)
+            where.append(f"responsable IN ({', '.join(['?'] * len(responsables))})")
+            params.extend(responsables)
+
+        # La secuencia se calcula en SQLite sobre TODO el filtro (igual que antes) y solo
+        # se traen páginas de LISTAR_PAGINA filas, de la más reciente hacia atrás.
+        # Paginación por llave (keyset) en el orden inverso de ORDEN_SECUENCIA_SQL.
+        seq = sql_secuencia_contador(cols, " AND ".join(where), orden="")
+        llave = "(fecha IS NULL, COALESCE(fecha, ''), hora IS NULL, COALESCE(hora, ''), id)"
+        orden_desc = "fecha IS NULL DESC, COALESCE(fecha, '') DESC, hora IS NULL DESC, COALESCE(hora, '') DESC, id DESC"
+        despues: Optional[Tuple[Any, ...]] = None
+        while True:
+            if despues is None:
+                sql = f"SELECT * FROM ({seq}) ORDER BY {orden_desc} LIMIT ?"
+                page_params = params + [LISTAR_PAGINA]
+            else:
+                sql = f"SELECT * FROM ({seq}) WHERE {llave} < (?, ?, ?, ?, ?) ORDER BY {orden_desc} LIMIT ?"
+                page_params = params + list(despues) + [LISTAR_PAGINA]
+            df = leer_df(conn, sql, page_params)
+
+            if df.empty:
+                if despues is None:
+                    print("📭 No hay registros para esos filtros.")
+                return
+
+            ult = df.iloc[-1]
+            sin_fecha, sin_hora = pd.isna(ult["fecha"]), pd.isna(ult["hora"])
+            despues = (
+                int(sin_fecha),
+                "" if sin_fecha else ult["fecha"],
+                int(sin_hora),
+                "" if sin_hora else ult["hora"],
+                int(ult["id"]),
+            )
 
-        if df.empty:
-            print("📭 No hay registros para esos filtros.")
-            return
+            # Mostrar columnas clave (cada página en orden cronológico)
+            show_cols = [c for c in ["id","fecha","hora","equipo","litros_despachados","volumen_despachado","responsable","contador_inicial","contador_final","Secuencia_Contador","Delta_Litros","tipo_registro"] if c in df.columns]
+            print(df[show_cols].iloc[::-1].to_string(index=False))
 
-        # Mostrar columnas clave
-        show_cols = [c for c in ["id","fecha","hora","equipo","litros_despachados","volumen_despachado","responsable","contador_inicial","contador_final","Secuencia_Contador","Delta_Litros","tipo_registro"] if c in df.columns]
-        print(df[show_cols].to_string(index=False))
+            if len(df) < LISTAR_PAGINA:
+                return
+            if pedir_texto("Enter = registros anteriores / 0 = terminar: ", allow_empty=True, default="") == "0":
+                return
 
 
 # =========================
 # Editar / Eliminar
 # =========================
 def editar(db_path: str) -> None:
-    ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         rid = pedir_texto("✏️ ID a editar: ")
         if not rid or not rid.isdigit():
             print("⚠️ ID inválido.")
@@ -1054,51 +1487,28 @@ def editar(db_path: str) -> None:
         responsable = pedir_texto(f"Responsable [{rec.get('responsable','')}]: ", allow_empty=True, default=rec.get("responsable"))
 
         # Si cambia litros, recalcular gal y sugerir contador_final
-        litros_old = rec.get("litros_despachados")
-        litros_new = pedir_texto(f"Litros despachados [{litros_old}]: ", allow_empty=True, default=str(litros_old) if litros_old is not None else "")
-        try:
-            litros_val = float(litros_new) if litros_new not in (None, "") else float(litros_old) if litros_old is not None else None
-        except ValueError:
-            print("⚠️ Litros inválidos. Se mantiene el valor anterior.")
-            litros_val = float(litros_old) if litros_old is not None else None
+        litros_old = a_float(rec.get("litros_despachados"))
+        litros_val = pedir_float_editar(f"Litros despachados [{rec.get('litros_despachados')}]: ", litros_old,
+                                        invalido=litros_old, aviso="⚠️ Litros inválidos. Se mantiene el valor anterior.")
 
         volumen_gal = rec.get("volumen_despachado")
         if litros_val is not None:
             volumen_gal = litros_a_gal(litros_val)
 
         # contador
-        ci_old = rec.get("contador_inicial") if rec.get("contador_inicial") is not None else 0.0
-        ci_in = pedir_texto(f"Contador inicial [{ci_old}]: ", allow_empty=True, default=str(ci_old))
-        try:
-            ci_val = float(ci_in) if ci_in is not None else float(ci_old)
-        except ValueError:
-            ci_val = float(ci_old)
+        ci_old = a_float(rec.get("contador_inicial"), 0.0)
+        ci_val = pedir_float_editar(f"Contador inicial [{ci_old}]: ", ci_old, invalido=ci_old)
 
         cf_sugerido = round(ci_val + (litros_val or 0.0), 2)
-        cf_old = rec.get("contador_final")
-        cf_in = pedir_texto(f"Contador final sugerido={cf_sugerido} (Enter para aceptar / escribe otro) [actual={cf_old}]: ",
-                            allow_empty=True, default=str(cf_sugerido))
-        try:
-            cf_val = float(cf_in) if cf_in is not None else cf_sugerido
-        except ValueError:
-            cf_val = cf_sugerido
+        cf_val = pedir_float_editar(
+            f"Contador final sugerido={cf_sugerido} (Enter para aceptar / escribe otro) [actual={rec.get('contador_final')}]: ",
+            cf_sugerido, invalido=cf_sugerido)
 
-        # horómetro (si existe)
+        # horómetro (si existe); un valor no numérico lo deja vacío
         hi_old = rec.get("horometro_inicial")
         hf_old = rec.get("horometro_final")
-        hi_in = pedir_texto(f"Horómetro inicial [{hi_old}]: ", allow_empty=True, default=str(hi_old) if hi_old is not None else "")
-        hf_in = pedir_texto(f"Horómetro final [{hf_old}]: ", allow_empty=True, default=str(hf_old) if hf_old is not None else "")
-
-        def parse_opt_float(s: Optional[str]) -> Optional[float]:
-            if s is None or s == "":
-                return None
-            try:
-                return float(s)
-            except ValueError:
-                return None
-
-        hi_val = parse_opt_float(hi_in)
-        hf_val = parse_opt_float(hf_in)
+        hi_val = pedir_float_editar(f"Horómetro inicial [{hi_old}]: ", a_float(hi_old))
+        hf_val = pedir_float_editar(f"Horómetro final [{hf_old}]: ", a_float(hf_old))
 
         horas = rec.get("horas_trabajadas")
         consumo = rec.get("consumo_por_gl_h")
@@ -1112,10 +1522,8 @@ def editar(db_path: str) -> None:
 
         # precio / costo
         precio_old = rec.get("precio_diesel")
-        precio_in = pedir_texto(f"Precio diesel (USD/gal) [{precio_old}]: ", allow_empty=True, default=str(precio_old) if precio_old is not None else "")
-        precio_val = parse_opt_float(precio_in)
-        if precio_val is None and precio_old is not None:
-            precio_val = float(precio_old)
+        precio_val = pedir_float_editar(f"Precio diesel (USD/gal) [{precio_old}]: ", a_float(precio_old),
+                                        invalido=a_float(precio_old))
 
         costo = rec.get("costo_diesel_usd")
         if precio_val is not None and volumen_gal is not None:
@@ -1123,7 +1531,7 @@ def editar(db_path: str) -> None:
 
         tipo = pedir_texto(f"Tipo registro [{rec.get('tipo_registro')}]: ", allow_empty=True, default=rec.get("tipo_registro"))
 
-        update_distribucion(conn, rid_i, dict(
+        nuevo = dict(
             fecha=fecha,
             hora=hora,
             equipo=(equipo or "").strip().upper() if equipo else None,
@@ -1139,12 +1547,14 @@ def editar(db_path: str) -> None:
             precio_diesel=precio_val,
             costo_diesel_usd=costo,
             tipo_registro=tipo,
-        ))
+        )
+        # UPDATE solo de lo que cambió (Enter en un campo = no se reescribe)
+        cambios = {k: v for k, v in nuevo.items() if v != rec.get(k)}
+        update_distribucion(conn, rid_i, cambios)
         print("✅ Registro actualizado.")
 
 def eliminar(db_path: str) -> None:
-    ensure_schema(db_path)
-    with connect(db_path) as conn:
+    with get_conn(db_path) as conn:
         rid = pedir_texto("🗑️ ID a eliminar: ")
         if not rid or not rid.isdigit():
             print("⚠️ ID inválido.")
@@ -1166,6 +1576,9 @@ def eliminar(db_path: str) -> None:
 # =========================
 # Exportar a Excel (plantilla)
 # =========================
+# Filas por fetchmany al exportar (memoria acotada al lote, no al mes completo)
+EXPORT_LOTE = 1000
+
 EXPORT_COLS = [
     ("fecha", "📅 Fecha"),
     ("equipo", "🛠️ Equipo"),
@@ -1182,109 +1595,243 @@ EXPORT_COLS = [
     ("costo_diesel_usd", "💰 Costo Diesel (USD)"),
 ]
 
-def copy_row_style(src_ws, src_row: int, dst_ws, dst_row: int, max_col: int) -> None:
-    for c in range(1, max_col + 1):
-        sc = src_ws.cell(row=src_row, column=c)
-        dc = dst_ws.cell(row=dst_row, column=c)
-        if sc.has_style:
-            dc._style = copy(sc._style)
-        dc.number_format = sc.number_format
-        dc.font = copy(sc.font)
-        dc.border = copy(sc.border)
-        dc.fill = copy(sc.fill)
-        dc.alignment = copy(sc.alignment)
-        dc.protection = copy(sc.protection)
-        dc.comment = sc.comment
-
-def copy_column_widths(src_ws, dst_ws, max_col: int) -> None:
-    for c in range(1, max_col + 1):
-        letter = openpyxl.utils.get_column_letter(c)
-        if letter in src_ws.column_dimensions:
-            dst_ws.column_dimensions[letter].width = src_ws.column_dimensions[letter].width
+# openpyxl (estilo de borde) -> índice de borde de xlsxwriter
+_BORDES_XLSX = {
+    "thin": 1, "medium": 2, "dashed": 3, "dotted": 4, "thick": 5, "double": 6, "hair": 7,
+    "mediumDashed": 8, "dashDot": 9, "mediumDashDot": 10, "dashDotDot": 11,
+    "mediumDashDotDot": 12, "slantDashDot": 13,
+}
+_HALIGN_XLSX = {"centerContinuous": "center_across", "general": None}
+_VALIGN_XLSX = {"center": "vcenter"}
+
+def _color_xlsx(color) -> Optional[str]:
+    """Color ARGB de openpyxl -> '#RRGGBB' (los colores de tema/indexados se omiten)."""
+    rgb = getattr(color, "rgb", None) if color is not None else None
+    if getattr(color, "type", None) != "rgb" or not isinstance(rgb, str) or len(rgb) != 8:
+        return None
+    return "#" + rgb[2:]
+
+def formato_xlsx(celda) -> Dict[str, Any]:
+    """
+    Estilo de una celda de la plantilla (openpyxl) como propiedades de formato de
+    xlsxwriter: fuente, relleno sólido, bordes, alineación y formato numérico.
+    """
+    props: Dict[str, Any] = {}
+    if not celda.has_style:
+        return props
+    f = celda.font
+    if f is not None:
+        if f.name:
+            props["font_name"] = f.name
+        if f.sz:
+            props["font_size"] = float(f.sz)
+        if f.b:
+            props["bold"] = True
+        if f.i:
+            props["italic"] = True
+        if f.u:
+            props["underline"] = 2 if f.u == "double" else 1
+        if f.strike:
+            props["font_strikeout"] = True
+        if _color_xlsx(f.color):
+            props["font_color"] = _color_xlsx(f.color)
+    fill = celda.fill
+    if getattr(fill, "patternType", None) == "solid" and _color_xlsx(fill.fgColor):
+        props["pattern"] = 1
+        props["bg_color"] = _color_xlsx(fill.fgColor)
+    for lado in ("left", "right", "top", "bottom"):
+        side = getattr(celda.border, lado, None)
+        if side is not None and side.style in _BORDES_XLSX:
+            props[lado] = _BORDES_XLSX[side.style]
+            if _color_xlsx(side.color):
+                props[f"{lado}_color"] = _color_xlsx(side.color)
+    al = celda.alignment
+    if al is not None:
+        h = _HALIGN_XLSX.get(al.horizontal, al.horizontal)
+        if h:
+            props["align"] = h
+        if al.vertical:
+            props["valign"] = _VALIGN_XLSX.get(al.vertical, al.vertical)
+        if al.wrap_text:
+            props["text_wrap"] = True
+        if al.indent:
+            props["indent"] = int(al.indent)
+        if al.text_rotation:
+            props["rotation"] = int(al.text_rotation)
+    if celda.number_format and celda.number_format != "General":
+        props["num_format"] = celda.number_format
+    return props
+
+# ruta de la plantilla -> (firma del archivo, lo que el export usa de ella o None si no trae la hoja)
+_PLANTILLA_CACHE: Dict[str, Tuple[Tuple[int, int], Optional[Dict[str, Any]]]] = {}
+
+def leer_plantilla(plantilla_xlsx: str) -> Optional[Dict[str, Any]]:
+    """
+    Lo que exportar_mes usa de la hoja Distribucion_Equipos, ya en términos de xlsxwriter:
+      encabezados: [(valor, props)] de la fila 1     fila: [props] de la fila ejemplo (2)
+      anchos: [(col0, col1, ancho)]                  alto: alto de la fila 1 (o None)
+      congelar: (fila, col) 0-based (o None)
+    Se parsea con openpyxl solo la primera vez o si cambió el archivo (mtime/tamaño).
+    None si la plantilla no tiene la hoja.
+    """
+    st = os.stat(plantilla_xlsx)
+    firma = (st.st_mtime_ns, st.st_size)
+    key = os.path.abspath(plantilla_xlsx)
+    cache = _PLANTILLA_CACHE.get(key)
+    if cache is not None and cache[0] == firma:
+        return cache[1]
+
+    import openpyxl
+    from openpyxl.utils.cell import coordinate_to_tuple
+
+    wb_tpl = openpyxl.load_workbook(plantilla_xlsx)
+    plantilla: Optional[Dict[str, Any]] = None
+    if "Distribucion_Equipos" in wb_tpl.sheetnames:
+        tpl = wb_tpl["Distribucion_Equipos"]
+        # Detectar # columnas por headers en fila 1
+        max_col = tpl.max_column
+        congelar = None
+        if tpl.freeze_panes:
+            fr, fc = coordinate_to_tuple(tpl.freeze_panes)
+            congelar = (fr - 1, fc - 1)
+        plantilla = {
+            "encabezados": [(tpl.cell(row=1, column=j).value, formato_xlsx(tpl.cell(row=1, column=j)))
+                            for j in range(1, max_col + 1)],
+            "fila": [formato_xlsx(tpl.cell(row=2, column=j)) for j in range(1, max_col + 1)] if tpl.max_row >= 2 else [],
+            "anchos": [(dim.min - 1, (dim.max or dim.min) - 1, dim.width)
+                       for dim in tpl.column_dimensions.values() if dim.width and dim.min],
+            "alto": tpl.row_dimensions[1].height,
+            "congelar": congelar,
+        }
+    _PLANTILLA_CACHE[key] = (firma, plantilla)
+    return plantilla
+
+@contextmanager
+def lotes_en_segundo_plano(conn: sqlite3.Connection, sql: str, params: Sequence[Any],
+                           tam: int = EXPORT_LOTE, max_lotes: int = 4) -> Iterator[Iterator[List[Tuple[Any, ...]]]]:
+    """
+    Ejecuta la consulta en un hilo y entrega los fetchmany por una cola acotada
+    (max_lotes): SQLite suelta el GIL mientras lee, así el siguiente lote se arma
+    mientras el hilo principal escribe el anterior. Al salir del with, aunque sea
+    antes de consumir todo, el hilo se detiene y se espera.
+    """
+    cola: "queue.Queue[Any]" = queue.Queue(maxsize=max_lotes)
+    cancelar = threading.Event()
+
+    def producir() -> None:
+        try:
+            cur = conn.execute(sql, params)
+            while not cancelar.is_set():
+                filas = cur.fetchmany(tam)
+                cola.put(filas)
+                if not filas:
+                    return
+        except BaseException as e:
+            cola.put(e)
+
+    def lotes() -> Iterator[List[Tuple[Any, ...]]]:
+        while True:
+            filas = cola.get()
+            if isinstance(filas, BaseException):
+                raise filas
+            if not filas:
+                return
+            yield filas
+
+    hilo = threading.Thread(target=producir, name="exportar_mes-lectura", daemon=True)
+    hilo.start()
+    try:
+        yield lotes()
+    finally:
+        cancelar.set()
+        # vaciar la cola para que un put() bloqueado no deje al hilo esperando
+        while hilo.is_alive():
+            try:
+                cola.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        hilo.join()
 
 def exportar_mes(db_path: str, plantilla_xlsx: str) -> None:
-    ensure_schema(db_path)
+    # xlsxwriter solo se necesita al exportar (se importa aquí para no cargarlo en cada rerun del dashboard)
+    import xlsxwriter
+
     mes = pedir_texto("📦 Mes a exportar (YYYY-MM) ej: 2025-09: ")
     if not mes or len(mes) != 7 or mes[4] != "-":
         print("⚠️ Formato de mes inválido.")
         return
 
-    with connect(db_path) as conn:
-        cols = get_columns(conn, "distribucion_hyundai_equipos")
-        # filtro por mes usando LIKE en fecha (YYYY-MM-%)
-        sql = f"SELECT {', '.join(cols)} FROM distribucion_hyundai_equipos WHERE fecha LIKE ? ORDER BY fecha ASC, hora ASC, id ASC"
-        df = pd.read_sql_query(sql, conn, params=[f"{mes}-%"])
-    df = normalize_df_columns(df)
-
-    # aplicar secuencia del contador (si viene en blanco en BD)
-    df = aplicar_secuencia_contador(df)
-
-    if df.empty:
-        print("📭 No hay registros para ese mes.")
-        return
-
-    # Preparar dataframe con columnas de exportación
-    out = pd.DataFrame()
-    for col_db, col_xl in EXPORT_COLS:
-        if col_db in df.columns:
-            out[col_xl] = df[col_db]
-        else:
-            out[col_xl] = None
-
-    # Si BD no trae contador_inicial/contador_final (o vienen totalmente vacíos), usamos los *_calc ya calculados
-    if '📟 Contador Inicial' in out.columns:
-        if ('contador_inicial' not in df.columns) or (df['contador_inicial'].isna().all()):
-            out['📟 Contador Inicial'] = df.get('contador_inicial_calc')
-        else:
-            out['📟 Contador Inicial'] = df.get('contador_inicial')
-
-    if '📟 Contador Final' in out.columns:
-        if ('contador_final' not in df.columns) or (df['contador_final'].isna().all()):
-            out['📟 Contador Final'] = df.get('contador_final_calc')
-        else:
-            out['📟 Contador Final'] = df.get('contador_final')
-
-
-
-    # Cargar plantilla
-    if not os.path.exists(plantilla_xlsx):
-        print(f"⚠️ No se encontró la plantilla: {plantilla_xlsx}")
-        return
-
-    wb = openpyxl.load_workbook(plantilla_xlsx)
-    if "Distribucion_Equipos" not in wb.sheetnames:
-        print("⚠️ La plantilla no tiene la hoja 'Distribucion_Equipos'.")
-        return
-
-    ws = wb["Distribucion_Equipos"]
-
-    # Detectar # columnas por headers en fila 1
-    max_col = ws.max_column
-
-    # Guardar estilo de una fila de ejemplo (fila 2) si existe
-    sample_row = 2 if ws.max_row >= 2 else 1
-
-    # Limpiar datos existentes (de fila 2 en adelante)
-    if ws.max_row >= 2:
-        ws.delete_rows(2, ws.max_row - 1)
-
-    # Escribir data desde fila 2
-    start_row = 2
-    for i, row in out.iterrows():
-        r = start_row + i
-        # Copiar estilos desde fila sample_row
-        if sample_row >= 2:
-            copy_row_style(ws, sample_row, ws, r, max_col)
-
-        for j, (col_db, col_xl) in enumerate(EXPORT_COLS, start=1):
-            ws.cell(row=r, column=j, value=row.get(col_xl))
-
-    # Ajustar widths a lo mismo (ya está en plantilla, pero por si acaso)
-    copy_column_widths(ws, ws, max_col)
+    with get_conn(db_path) as conn:
+        # filtro por mes como rango en fecha (YYYY-MM-..), usa el índice; las filas se
+        # leen por lotes en otro hilo y van directo a la hoja, sin pasar por pandas
+        sql = sql_export_mes(conn)
+        with lotes_en_segundo_plano(conn, sql, rango_mes(mes)) as lotes:
+            # Plantilla (solo se lee: encabezados, estilos, anchos; cacheada) mientras SQLite arma el mes
+            existe = os.path.exists(plantilla_xlsx)
+            plantilla = leer_plantilla(plantilla_xlsx) if existe else None
+            filas = next(lotes, None)
+
+            if filas is None:
+                print("📭 No hay registros para ese mes.")
+                return
+
+            if not existe:
+                print(f"⚠️ No se encontró la plantilla: {plantilla_xlsx}")
+                return
+
+            if plantilla is None:
+                print("⚠️ La plantilla no tiene la hoja 'Distribucion_Equipos'.")
+                return
+
+            # El archivo de salida se escribe en streaming con xlsxwriter (constant_memory):
+            # las filas van directo a disco, sin armar ni serializar el DOM de openpyxl
+            out_name = f"Distribucion_Equipos_{mes}.xlsx"
+            wb = xlsxwriter.Workbook(out_name, {"constant_memory": True})
+            ws = wb.add_worksheet("Distribucion_Equipos")
+
+            # un formato de xlsxwriter por estilo distinto de la plantilla
+            formatos: Dict[Tuple[Any, ...], Any] = {}
+            def fmt(props: Dict[str, Any]):
+                key = tuple(sorted(props.items()))
+                if key not in formatos:
+                    formatos[key] = wb.add_format(props) if props else None
+                return formatos[key]
+
+            # Anchos de columna de la plantilla
+            for c0, c1, ancho_col in plantilla["anchos"]:
+                ws.set_column(c0, c1, ancho_col)
+            if plantilla["congelar"]:
+                ws.freeze_panes(*plantilla["congelar"])
+
+            # Encabezados (fila 1) tal cual la plantilla
+            if plantilla["alto"]:
+                ws.set_row(0, plantilla["alto"])
+            for j, (valor, props) in enumerate(plantilla["encabezados"]):
+                ws.write(0, j, valor, fmt(props))
+
+            # Formato de la fila de ejemplo (fila 2) por columna, si existe
+            estilos = [fmt(props) for props in plantilla["fila"]]
+
+            # Escribir data desde fila 2 (una sola pasada: valor + formato de la fila ejemplo).
+            # Un Format compartido por columna; columnas de la plantilla sin dato van en blanco
+            ncols = len(EXPORT_COLS)
+            ancho = max(ncols, len(estilos))
+            estilos += [None] * (ancho - len(estilos))
+            relleno = (None,) * (ancho - ncols)
+            r = 1
+            while filas:
+                for valores in filas:
+                    for j, (v, f) in enumerate(zip(valores + relleno, estilos)):
+                        if v is None:
+                            if f is not None:
+                                ws.write_blank(r, j, None, f)
+                        else:
+                            ws.write(r, j, v, f)
+                    r += 1
+                filas = next(lotes, None)
 
     # Guardar
-    out_name = f"Distribucion_Equipos_{mes}.xlsx"
-    wb.save(out_name)
+    wb.close()
     print(f"✅ Exportado: {out_name}")
 
 
@@ -1292,6 +1839,8 @@ def exportar_mes(db_path: str, plantilla_xlsx: str) -> None:
 # Menú
 # =========================
 def menu() -> None:
+    # Esquema/índices una sola vez al arrancar; las opciones del menú ya no lo repiten
+    ensure_schema(DB_PATH)
     while True:
         print("\n" + "="*60)
         print("HYUNDAI | Distribución a Equipos")